@@ -1,12 +1,19 @@
 # connection.py
+import io
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Optional
+import urllib3
 import influxdb_client
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.exceptions import InfluxDBError
+from influxdb_client.domain.dialect import Dialect
 import dotenv
 import pandas as pd
+import pyarrow.csv as pacsv
 from utils.timezone_utils import convert_to_colombia_time
 
 # --------- Config ---------
@@ -23,46 +30,69 @@ class ConnectionNotReady(Exception):
     """La conexión no está lista (aún)."""
 
 # --------- Cliente (sin UI) ---------
+# Cliente compartido: una sola pool de conexiones HTTP para todas las páginas
+_client_singleton: Optional[InfluxDBClient] = None
+_client_lock = threading.Lock()
+
 def _new_client() -> InfluxDBClient:
     """
-    Crea el cliente 
+    Devuelve el cliente compartido (se crea una única vez por proceso).
     """
-    return influxdb_client.InfluxDBClient(
-        url=INFLUX_URL,
-        token=INFLUX_TOKEN,
-        org=INFLUX_ORG,
-        timeout=30_000,  
-        enable_gzip=True
-    )
+    global _client_singleton
+    with _client_lock:
+        if _client_singleton is None:
+            _client_singleton = influxdb_client.InfluxDBClient(
+                url=INFLUX_URL,
+                token=INFLUX_TOKEN,
+                org=INFLUX_ORG,
+                timeout=30_000,
+                enable_gzip=True,
+                connection_pool_maxsize=32,
+                retries=urllib3.Retry(total=3, backoff_factor=0.2),
+            )
+        return _client_singleton
+
+# La sonda Flux de validación se ejecuta una sola vez por proceso
+_validated_once = False
 
 def ping(client: InfluxDBClient) -> bool:
     """
-    Verifica que el servidor responda.
+    Verifica que el servidor responda (un solo round-trip tras la primera vez).
     """
-    
+    global _validated_once
+
     try:
         if not client.ping():
             return False
-        # Consulta para validar la conexión:
-        q = 'buckets() |> limit(n:1)'
-        _ = client.query_api().query(q)
+        if not _validated_once:
+            # Consulta para validar la conexión (solo la primera vez):
+            with _client_lock:
+                if not _validated_once:
+                    q = 'buckets() |> limit(n:1)'
+                    _ = client.query_api().query(q)
+                    _validated_once = True
         return True
     except Exception:
         return False
 
 def wait_until_ready(
     max_wait_seconds: int = 10,
-    interval_seconds: float = 1.0
+    interval_seconds: float = 0.1
 ) -> InfluxDBClient:
     """
-    Reintentar conexión.
+    Reintentar conexión con backoff exponencial (0.1s, 0.2s, ... máx 2s).
+
+    Un servidor sano responde en el primer intento (<100ms); el backoff
+    solo alarga la espera cuando de verdad hay un fallo transitorio.
     """
     client = _new_client()
     deadline = time.time() + max_wait_seconds
+    delay = interval_seconds
     while time.time() < deadline:
         if ping(client):
             return client
-        time.sleep(interval_seconds)
+        time.sleep(delay)
+        delay = min(delay * 2, 2.0)
     raise ConnectionNotReady("InfluxDB no está listo aún.")
 
 # --------- API de alto nivel para páginas ---------
@@ -73,42 +103,241 @@ def get_client_or_raise() -> InfluxDBClient:
         raise ConnectionNotReady("No fue posible validar la conexión con InfluxDB.")
     return client
 
+# CSV sin anotaciones para poder parsearlo con pyarrow de una sola pasada
+_RAW_DIALECT = Dialect(header=True, delimiter=",", annotations=[], date_time_format="RFC3339")
+
+# Columnas de sensores/coordenadas que se compactan a float32
+_SENSOR_COLUMNS = ("CO2", "PM2.5", "Temperature", "Lat", "Lon")
+
+# Columnas de contabilidad de Flux que el codificador CSV siempre añade
+# y que ninguna página consume
+_NOISE_COLUMNS = ["result", "table", "_start", "_stop", "_measurement"]
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce los dtypes del resultado: float32 para valores de sensores y
+    category para la ruta. La mitad de memoria y groupbys más rápidos.
+    """
+    for c in _SENSOR_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], downcast="float")
+    if "location" in df.columns:
+        df["location"] = df["location"].astype("category")
+    return df
+
 def run_query(client: InfluxDBClient, flux: str):
     """
-    Ejecuta una query Flux y convierte timestamps a zona horaria colombiana
+    Ejecuta una query Flux y convierte timestamps a zona horaria colombiana.
+
+    Usa query_raw + pyarrow.csv (parser columnar en C, _time queda tz-aware)
+    en lugar de query_data_frame, que parsea el CSV fila a fila en Python.
     """
-    df = client.query_api().query_data_frame(flux)
+    df = None
+    try:
+        raw = client.query_api().query_raw(flux, dialect=_RAW_DIALECT)
+        data = raw.data if hasattr(raw, "data") else raw
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if data:
+            table = pacsv.read_csv(io.BytesIO(data))
+            df = table.to_pandas()
+            # El CSV de Flux trae una primera columna vacía de anotaciones
+            if "" in df.columns:
+                df = df.drop(columns=[""])
+        else:
+            df = pd.DataFrame()
+    except Exception:
+        # Fallback al parser del cliente si el CSV no es uniforme
+        df = client.query_api().query_data_frame(flux)
+        # Las queries con group() pueden devolver una lista de tablas
+        if isinstance(df, list):
+            df = pd.concat(df, ignore_index=True) if df else pd.DataFrame()
+    df = df.drop(columns=[c for c in _NOISE_COLUMNS if c in df.columns])
+    df = _compact_dtypes(df)
     # Convert timestamps to Colombian timezone
     df = convert_to_colombia_time(df)
     return df
 
 
-def flux_query(bucket: Optional[str] = None, start: str = "-1h") -> str:
+def rounded_start(days: int) -> str:
+    """
+    Timestamp RFC3339 alineado a la hora para usar como `range(start: ...)`.
+
+    Una ventana deslizante como "-100d" cambia en cada ejecución y fuerza a
+    InfluxDB a re-escanear; un inicio redondeado se repite entre queries
+    consecutivas y aprovecha los índices/caches del motor de almacenamiento.
+    """
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+    return start.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def run_queries(client: InfluxDBClient, fluxes: list):
+    """
+    Ejecuta varias queries Flux en paralelo sobre la pool compartida.
+
+    El costo dominante es la red: lanzarlas a la vez reduce la espera
+    total a la de la query más lenta en lugar de la suma de todas.
+    """
+    if len(fluxes) <= 1:
+        return [run_query(client, f) for f in fluxes]
+    with ThreadPoolExecutor(max_workers=min(4, len(fluxes))) as pool:
+        return list(pool.map(lambda f: run_query(client, f), fluxes))
+
+
+def flux_query(
+    bucket: Optional[str] = None,
+    start: str = "-1h",
+    stop: Optional[str] = None,
+    locations: Optional[list] = None,
+    include_geo: bool = True,
+    every: str = "10s",
+) -> str:
     """
     Genera una query Flux para obtener datos de sensores.
+
+    Con include_geo=False ni siquiera se consultan las series Lat/Lon:
+    menos bytes transferidos para consumidores que no dibujan mapas.
+    Los parámetros stop/locations empujan los filtros de fecha y ruta al
+    servidor: solo cruzan la red las filas que la página va a mostrar, y
+    `every` controla la resolución del aggregateWindow (también pushdown)
+    para que consumidores de rangos largos pidan menos puntos.
     """
     bucket = bucket or DEFAULT_BUCKET
-    
+
+    measurements = ["CO2", "PM2.5", "Temperature"]
+    if include_geo:
+        measurements += ["Lat", "Lon"]
+
+    measurement_filter = " or\n    ".join(f'r._measurement == "{m}"' for m in measurements)
+    keep_columns = ", ".join(f'"{c}"' for c in ["_time", "location"] + measurements)
+
+    range_args = f"start: {start}, stop: {stop}" if stop else f"start: {start}"
+
+    location_filter = ""
+    if locations:
+        location_set = ", ".join(f'"{l}"' for l in locations)
+        location_filter = (
+            f"\n  |> filter(fn: (r) => contains(value: r.location, set: [{location_set}]))"
+        )
+
+    return f'''
+  from(bucket: "{bucket}")
+  |> range({range_args})
+  |> filter(fn: (r) =>
+    {measurement_filter}
+  ){location_filter}
+  |> aggregateWindow(every: {every}, fn: last, createEmpty: false)
+  |> pivot(
+      rowKey: ["_time","location"],
+      columnKey: ["_measurement"],
+      valueColumn: "_value"
+  )
+  |> keep(columns: [{keep_columns}])
+  |> sort(columns: ["location","_time"])
+  '''
+
+# --------- Refresco en segundo plano ---------
+class DataRefresher:
+    """
+    Hilo de fondo que refresca un snapshot del dataframe cada `interval_seconds`.
+
+    Desacopla la latencia de la UI de la latencia de la query: las páginas
+    leen el último snapshot sin esperar a InfluxDB.
+
+    `flux` puede ser el string de la query o un callable sin argumentos que
+    la genere; el callable permite recomputar partes variables (p.ej.
+    rounded_start) en cada ciclo sin que la identidad del refrescador cambie.
+    """
+
+    def __init__(self, flux, interval_seconds: float = 10.0):
+        self._flux = flux
+        self._interval = interval_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._df = pd.DataFrame()
+        self._ts = 0.0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                flux = self._flux() if callable(self._flux) else self._flux
+                df = run_query(_new_client(), flux)
+                with self._lock:
+                    self._df = df
+                    self._ts = time.time()
+            except Exception:
+                # Conservar el último snapshot válido ante fallos transitorios
+                pass
+            self._stop.wait(self._interval)
+
+    def snapshot(self):
+        """Último dataframe refrescado y el momento en que se obtuvo."""
+        with self._lock:
+            return self._df, self._ts
+
+    def stop(self):
+        self._stop.set()
+
+
+def flux_location_means(bucket: Optional[str] = None, start: str = "-1h") -> str:
+    """
+    Genera una query Flux con los promedios de PM2.5 y CO2 por ruta,
+    calculados en el servidor (evita traer filas crudas para agrupar en pandas).
+    Excluye el centinela -1 de lecturas inválidas antes de promediar, igual
+    que hacen las páginas con el frame crudo.
+    """
+    bucket = bucket or DEFAULT_BUCKET
+
     return f'''
   from(bucket: "{bucket}")
   |> range(start: {start})
   |> filter(fn: (r) =>
     r._measurement == "CO2" or
-    r._measurement == "PM2.5" or
-    r._measurement == "Temperature" or
-    r._measurement == "Lat" or
-    r._measurement == "Lon"
+    r._measurement == "PM2.5"
   )
-  |> aggregateWindow(every: 10s, fn: last, createEmpty: false)
+  |> filter(fn: (r) => r._value != -1.0)
+  |> group(columns: ["location", "_measurement"])
+  |> mean()
+  |> group()
+  |> pivot(
+      rowKey: ["location"],
+      columnKey: ["_measurement"],
+      valueColumn: "_value"
+  )
+  |> keep(columns: ["location","CO2","PM2.5"])
+  '''
+
+
+def flux_hourly_means(bucket: Optional[str] = None, start: str = "-1h") -> str:
+    """
+    Genera una query Flux con promedios de PM2.5 y CO2 en ventanas de 1 hora,
+    agregados en el servidor. Devuelve unas pocas filas por día en lugar de
+    todos los puntos crudos. Excluye el centinela -1 de lecturas inválidas
+    antes de promediar, igual que hacen las páginas con el frame crudo.
+    """
+    bucket = bucket or DEFAULT_BUCKET
+
+    return f'''
+  from(bucket: "{bucket}")
+  |> range(start: {start})
+  |> filter(fn: (r) =>
+    r._measurement == "CO2" or
+    r._measurement == "PM2.5"
+  )
+  |> filter(fn: (r) => r._value != -1.0)
+  |> aggregateWindow(every: 1h, fn: mean, createEmpty: false)
   |> pivot(
       rowKey: ["_time","location"],
       columnKey: ["_measurement"],
       valueColumn: "_value"
   )
-  |> keep(columns: ["_time","location","Lat","Lon","CO2","Temperature","PM2.5"])
-  |> sort(columns: ["location","_time"])
+  |> keep(columns: ["_time","location","CO2","PM2.5"])
+  |> sort(columns: ["_time"])
   '''
 
+
 if __name__ == "__main__":
     client = get_client_or_raise()
     flux = flux_query(start="-1h")
@@ -1,173 +1,485 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
+import numpy as np
 import pydeck as pdk
 import time
 from datetime import datetime
-from data.connection import get_client_or_raise, run_query, flux_query, ConnectionNotReady
+from data.connection import get_client_or_raise, run_query, flux_query, rounded_start, ConnectionNotReady, DataRefresher
 from influxdb_client import InfluxDBClient
 from utils.timezone_utils import format_colombia_time
 
 if "map_controls" not in st.session_state:
     st.session_state.map_controls = False
 
+# Bordes superiores y tabla de colores PM2.5, construidos una sola vez al importar
+_PM25_EDGES = np.array([12.0, 35.4, 55.4, 150.4, 250.4, 500.4])
+_PM25_HEX_COLORS = np.array(["#00e400", "#ffff00", "#ff7e00", "#ff0000", "#8f3f97", "#7e0023", "#7e0023"])
+
+def get_route_colors(pm25_values):
+    """Mapea valores de PM2.5 a colores hex AQI con una búsqueda binaria en C."""
+    return _PM25_HEX_COLORS[np.searchsorted(_PM25_EDGES, np.asarray(pm25_values))].tolist()
+
+# Tablas de consulta por índice de bin: categoría y color RGBA (hex ya parseado)
+_PM25_CATEGORIES = np.array(["Buena", "Moderada", "Dañina para sensibles", "Dañina", "Muy dañina", "Peligrosa"], dtype=object)
+_PM25_RGBA = np.array(
+    [[int(h[1:3], 16), int(h[3:5], 16), int(h[5:7], 16), 180] for h in _PM25_HEX_COLORS[:-1]],
+    dtype=np.uint8,
+)
+
+def classify_pm25(values):
+    """Categoría y color RGBA de cada punto con una sola búsqueda vectorizada.
+
+    Las lecturas inválidas (NaN o el centinela -1 del sensor) no caen en
+    "Buena": se marcan "No disponible" con un gris neutro.
+    """
+    vals = np.asarray(values, dtype=float)
+    idx = np.searchsorted(_PM25_EDGES, vals)
+    idx = np.clip(idx, 0, len(_PM25_CATEGORIES) - 1)
+    cats = _PM25_CATEGORIES[idx]
+    rgba = _PM25_RGBA[idx]
+    invalid = ~(vals >= 0)
+    if invalid.any():
+        cats[invalid] = "No disponible"
+        rgba[invalid] = (128, 128, 128, 120)
+    return cats, rgba
+
+# Umbrales estándar de CO2 (ppm) y temperatura (°C) con sus colores RGBA
+_CO2_EDGES = np.array([400, 600, 1000, 5000, 10000])
+_CO2_RGBA = np.array(
+    [[0, 255, 0, 180], [128, 255, 0, 180], [255, 255, 0, 180],
+     [255, 165, 0, 180], [255, 69, 0, 180], [255, 0, 0, 180]],
+    dtype=np.uint8,
+)
+_TEMP_EDGES = np.array([10, 15, 20, 25, 30, 35])
+_TEMP_RGBA = np.array(
+    [[0, 0, 255, 180], [0, 128, 255, 180], [0, 255, 255, 180], [0, 255, 0, 180],
+     [255, 255, 0, 180], [255, 165, 0, 180], [255, 0, 0, 180]],
+    dtype=np.uint8,
+)
+
+def co2_colors(values):
+    """Color RGBA por punto según los umbrales estándar de CO2."""
+    return _CO2_RGBA[np.searchsorted(_CO2_EDGES, np.asarray(values, dtype=float))].tolist()
+
+def temp_colors(values):
+    """Color RGBA por punto según los umbrales estándar de temperatura."""
+    return _TEMP_RGBA[np.searchsorted(_TEMP_EDGES, np.asarray(values, dtype=float))].tolist()
+
+
+# Fingerprint barato del frame filtrado: suficiente para detectar datos nuevos
+# sin rehashear cada fila en cada rerun del fragmento. Incluye el conteo por
+# ruta: con aggregateWindow las rutas comparten timestamps alineados y dos
+# selecciones de rutas distintas pueden coincidir en longitud y extremos.
+def _paths_df_key(df: pd.DataFrame):
+    if df.empty or '_time' not in df.columns:
+        return (len(df),)
+    key = (len(df), str(df['_time'].iloc[0]), str(df['_time'].iloc[-1]))
+    if 'location' in df.columns:
+        key += tuple(df['location'].value_counts(sort=False).to_list())
+    return key
+
+# Los segmentos solo dependen de los datos y del filtro AQI; cachearlos evita
+# reconstruirlos en cada tick del auto-refresco cuando el snapshot no cambió
+@st.cache_data(ttl=60, show_spinner=False, hash_funcs={pd.DataFrame: _paths_df_key})
+def build_paths(df: pd.DataFrame, selected_aqi_categories=None) -> list[dict]:
+    
+    paths_data = []
+    if len(df) < 2:
+        return paths_data
+
+    def _build_for_subset(sub: pd.DataFrame) -> list[dict]:
+        # Ensure data is sorted by time within each subset. La query ya ordena
+        # por (location, _time) y los filtros preservan el orden, así que el
+        # caso normal es un chequeo O(N) de monotonía en lugar del sort
+        if "_time" in sub.columns and not sub['_time'].is_monotonic_increasing:
+            sub = sub.sort_values("_time")
+
+        # Filter out invalid coordinates (-1, -1) within the subset
+        if 'Lat' in sub.columns and 'Lon' in sub.columns:
+            sub = sub[(sub['Lat'] != -1) & (sub['Lon'] != -1)]
+
+        # If after filtering we have less than 2 points, return empty
+        if len(sub) < 2:
+            return []
+
+        lats = sub['Lat'].to_numpy(dtype=float)
+        lons = sub['Lon'].to_numpy(dtype=float)
+        # Coordenadas redondeadas a 6 decimales (~10cm) antes de serializar:
+        # los float32 de la ingesta arrastran ruido de representación
+        # (-73.12000274658203) que multiplica los bytes del JSON
+        coords = np.round(np.column_stack((lons, lats)), 6)
+
+        # Máscara de segmentos consecutivos válidos, calculada de una vez:
+        # sin saltos de más de 3 minutos ni de más de ~0.01 grados (~1km)
+        keep = np.ones(len(sub) - 1, dtype=bool)
+        if '_time' in sub.columns:
+            ns = sub['_time'].values.astype('datetime64[ns]').view('i8')
+            keep &= np.abs(np.diff(ns)) <= 180 * 1_000_000_000
+        keep &= np.hypot(np.diff(lats), np.diff(lons)) <= 0.01
+        if not keep.any():
+            return []
+
+        # Índice del punto inicial de cada segmento que sobrevive
+        idx = np.flatnonzero(keep)
+
+        if 'pm25_category' in sub.columns:
+            cats = sub['pm25_category'].to_numpy(dtype=object)[idx]
+        else:
+            cats = np.full(idx.size, "No disponible", dtype=object)
+
+        # Opacidad según el filtro de categorías AQI, resuelta por lote
+        if selected_aqi_categories is None:
+            opacity = np.full(idx.size, 200)
+        else:
+            opacity = np.where(np.isin(cats, list(selected_aqi_categories)), 200, 60)
+
+        if 'pm25_r' in sub.columns:
+            rgb = np.column_stack((
+                sub['pm25_r'].to_numpy(),
+                sub['pm25_g'].to_numpy(),
+                sub['pm25_b'].to_numpy(),
+            ))[idx].astype(int)
+        else:
+            rgb = np.tile(np.array([0, 228, 0]), (idx.size, 1))
+
+        if '_time' in sub.columns:
+            stamps = sub['_time'].dt.strftime("%Y-%m-%d %H:%M:%S COT").to_numpy()[idx]
+        else:
+            stamps = np.full(idx.size, "No disponible", dtype=object)
+
+        def _tooltip_col(name):
+            if name in sub.columns:
+                return sub[name].to_numpy()[idx]
+            return np.zeros(idx.size)
+
+        co2_vals = _tooltip_col("co2_value")
+        pm25_vals = _tooltip_col("pm25_value")
+        temp_vals = _tooltip_col("temperature")
+        locs = (
+            sub['location'].astype(str).to_numpy()[idx]
+            if 'location' in sub.columns
+            else np.full(idx.size, "No disponible", dtype=object)
+        )
+
+        # Fusionar segmentos consecutivos del mismo color/opacidad en una sola
+        # polilínea: PathLayer recibe un trazo por tramo homogéneo en lugar de
+        # una entrada por arista, con una fracción del JSON y de primitivas
+        # GPU. El tooltip queda a nivel de tramo (valores de su inicio).
+        breaks = np.flatnonzero(
+            (np.diff(idx) != 1)
+            | (cats[1:] != cats[:-1])
+            | (opacity[1:] != opacity[:-1])
+        )
+        run_starts = np.r_[0, breaks + 1]
+        run_ends = np.r_[breaks, idx.size - 1]
+
+        paths = []
+        for s, e in zip(run_starts, run_ends):
+            first, stop = idx[s], idx[e] + 2
+            paths.append({
+                "path": coords[first:stop].tolist(),
+                "R": int(rgb[s, 0]),
+                "G": int(rgb[s, 1]),
+                "B": int(rgb[s, 2]),
+                "A": int(opacity[s]),
+                "pm25_category": cats[s],
+                "co2_value": round(float(co2_vals[s]), 2),
+                "pm25_value": round(float(pm25_vals[s]), 2),
+                "temperature": round(float(temp_vals[s]), 2),
+                "timestamp": stamps[s],
+                "location": locs[s],
+            })
+        return paths
+
+    if "location" in df.columns:
+        # Group by location to ensure we don't connect paths between different routes
+        for location, sub in df.groupby("location", observed=True):
+            if len(sub) >= 2:  # Only process if we have at least 2 points
+                paths_data.extend(_build_for_subset(sub))
+    else:
+        if "header_deviceId" in df.columns:
+            for device, sub in df.groupby("header_deviceId"):
+                if len(sub) >= 2:
+                    paths_data.extend(_build_for_subset(sub))
+        else:
+            paths_data = _build_for_subset(df)
+
+    return paths_data
+
+# El enriquecimiento (filtrado de coordenadas, colores, columnas de tooltip)
+# solo depende de los datos: cachearlo evita repetirlo cuando el usuario
+# mueve filtros o la leyenda sin que haya llegado un snapshot nuevo
+@st.cache_data(ttl=60, show_spinner=False, hash_funcs={pd.DataFrame: _paths_df_key})
+def prepare_map_df(df: pd.DataFrame) -> pd.DataFrame:
+    # Filter out invalid coordinates (-1, -1) before processing
+    if 'Lat' in df.columns and 'Lon' in df.columns:
+        df = df[(df['Lat'] != -1) & (df['Lon'] != -1)].copy()
+
+    if df.empty:
+        return df
+
+    if 'PM2.5' in df.columns:
+        # Aplicar colores y categorías (una búsqueda binaria, sin apply por fila)
+        cats, rgba = classify_pm25(df['PM2.5'].to_numpy())
+        df['pm25_category'] = cats
+        # Componentes de color como columnas uint8 (SoA): los subgrupos del
+        # groupby llegan tipados y build_paths corta arrays directamente
+        df['pm25_r'] = rgba[:, 0]
+        df['pm25_g'] = rgba[:, 1]
+        df['pm25_b'] = rgba[:, 2]
+
+        # Crear columnas para el tooltip
+        df['co2_value'] = df.get('CO2', 0).round(1)
+        df['pm25_value'] = df['PM2.5'].round(1)
+        df['temperature'] = df.get('Temperature', 0).round(1)
+
+    return df
+
+# Deck completo cacheado por snapshot y filtros: mientras no cambien ni los
+# datos ni la seleccion, los reruns reutilizan las capas ya construidas y
+# solo pagan la serializacion del mismo objeto
+@st.cache_resource(ttl=60, max_entries=8, show_spinner=False, hash_funcs={pd.DataFrame: _paths_df_key})
+def build_map_deck(df: pd.DataFrame, params_key: tuple, dict_mode: bool, aqi_key) -> pdk.Deck:
+    # Initialize layers list
+    layers = []
+    
+    # Add heatmap layers based on selected parameters
+    if dict_mode and params_key:
+        
+        # CO2 Scatter Layer
+        if 'CO2' in params_key and 'CO2' in df.columns:
+            co2_data = df.dropna(subset=['CO2'])
+            # Additional filtering for invalid coordinates
+            if 'Lat' in co2_data.columns and 'Lon' in co2_data.columns:
+                co2_data = co2_data[(co2_data['Lat'] != -1) & (co2_data['Lon'] != -1)].copy()
+            
+            if not co2_data.empty:
+                # Payload mínimo: la capa no es pickable, así que solo
+                # viajan al navegador posición y color
+                colors = co2_colors(co2_data['CO2'].to_numpy())
+                # Redondear a 6 decimales: los float32 de la ingesta
+                # arrastran ruido de representación que engorda el JSON
+                co2_data = co2_data[['Lon', 'Lat']].astype('float64').round(6)
+                co2_data['co2_color'] = colors
+
+                co2_scatter = pdk.Layer(
+                    'ScatterplotLayer',
+                    data=co2_data,
+                    get_position='[Lon, Lat]',
+                    get_color='co2_color',
+                    opacity=0.5,
+                    pickable=False
+                )
+                layers.append(co2_scatter)
+        
+        # Temperature Heatmap Layer
+        if 'Temp' in params_key and 'Temperature' in df.columns:
+            temp_data = df.dropna(subset=['Temperature'])
+            # Additional filtering for invalid coordinates
+            if 'Lat' in temp_data.columns and 'Lon' in temp_data.columns:
+                temp_data = temp_data[(temp_data['Lat'] != -1) & (temp_data['Lon'] != -1)].copy()
+            
+            if not temp_data.empty:
+                # Normalize temperature values for better visualization (0-1 range)
+                temp_min = temp_data['Temperature'].min()
+                temp_max = temp_data['Temperature'].max()
+                if temp_max > temp_min:
+                    weights = ((temp_data['Temperature'] - temp_min) / (temp_max - temp_min)).to_numpy()
+                else:
+                    weights = np.full(len(temp_data), 0.5)
+
+                # Pre-agrupar en una grilla geográfica ~100x100: el payload
+                # baja de N puntos a unas pocas celdas y ScreenGridLayer
+                # agrega en GPU sin re-calcular el KDE en cada pan/zoom
+                grid = pd.DataFrame({
+                    'Lat': temp_data['Lat'].to_numpy(dtype=float),
+                    'Lon': temp_data['Lon'].to_numpy(dtype=float),
+                    'weight': weights,
+                })
+                grid['lat_bin'] = pd.cut(grid['Lat'], bins=100, labels=False)
+                grid['lon_bin'] = pd.cut(grid['Lon'], bins=100, labels=False)
+                cells = grid.groupby(['lat_bin', 'lon_bin'], observed=True).agg(
+                    Lat=('Lat', 'mean'), Lon=('Lon', 'mean'), weight=('weight', 'sum')
+                ).reset_index(drop=True).round({'Lat': 6, 'Lon': 6, 'weight': 3})
+
+                temp_grid = pdk.Layer(
+                    'ScreenGridLayer',
+                    data=cells,
+                    get_position='[Lon, Lat]',
+                    get_weight='weight',
+                    cell_size_pixels=30,
+                    opacity=0.6,
+                    color_range=[
+                        [0, 0, 255],      # Blue (cold)
+                        [0, 255, 255],    # Cyan
+                        [0, 255, 0],      # Green
+                        [255, 255, 0],    # Yellow
+                        [255, 165, 0],    # Orange
+                        [255, 0, 0]       # Red (hot)
+                    ],
+                    pickable=False
+                )
+                layers.append(temp_grid)
+    
+    # Add PM2.5 paths layer only if PM2.5 is selected
+    if 'PM2.5' in params_key:
+        # Convert to DataFrame and add LineLayer for PM2.5 paths
+        
+        paths_df = build_paths(df, aqi_key)
+        # PathLayer: una polilínea por tramo homogéneo en lugar de una
+        # entrada por arista (menos JSON y menos primitivas en GPU)
+        line_layer = pdk.Layer(
+            'PathLayer',
+            data=paths_df,
+            get_path='path',
+            get_color='[R, G, B, A]',  # Use the opacity from data
+            get_width=10,
+            width_min_pixels=3,
+            highlight_color=[0, 0, 255],
+            picking_radius=10,
+            auto_highlight=True,
+            pickable=True
+        )
+        
+        layers.append(line_layer)
+    
+    if 'CO2' in params_key:
+        co2_data = df.dropna(subset=['CO2'])
+        if not co2_data.empty:
+            # Get min and max CO2 values for color scaling
+            co2_min = co2_data['CO2'].min()
+            co2_max = co2_data['CO2'].max()
+
+            # Payload mínimo: la capa no es pickable, así que solo viajan
+            # al navegador posición, color y radio (LUT a nivel de módulo)
+            co2_values = co2_data['CO2'].to_numpy()
+            # Redondear antes de serializar: menos bytes de JSON por punto
+            co2_data = co2_data[['Lon', 'Lat']].astype('float64').round(6)
+            co2_data['co2_color'] = co2_colors(co2_values)
+            co2_data['co2_size'] = np.round((co2_values - co2_min) / (co2_max - co2_min) * 50 + 10, 1) if co2_max > co2_min else 30
+
+            co2_scatter = pdk.Layer(
+                'ScatterplotLayer',
+                data=co2_data,
+                get_position='[Lon, Lat]',
+                get_color='co2_color',
+                get_radius='co2_size',
+                radius_scale=1,
+                radius_min_pixels=5,
+                radius_max_pixels=60,
+                pickable=False,
+                auto_highlight=False,
+                opacity=0.8
+            )
+
+            layers.append(co2_scatter)
+
+    if 'Temperature' in params_key:
+        temp_data = df.dropna(subset=['Temperature'])
+        # Additional filtering for invalid coordinates
+        if 'Lat' in temp_data.columns and 'Lon' in temp_data.columns:
+            temp_data = temp_data[(temp_data['Lat'] != -1) & (temp_data['Lon'] != -1)].copy()
+        
+        if not temp_data.empty:
+            # Get min and max temperature values for color scaling
+            temp_min = temp_data['Temperature'].min()
+            temp_max = temp_data['Temperature'].max()
+            
+            # Payload mínimo: la capa no es pickable, así que solo viajan
+            # al navegador posición, color y elevación (LUT a nivel de módulo)
+            temp_values = temp_data['Temperature'].to_numpy()
+            # Redondear antes de serializar: menos bytes de JSON por punto
+            temp_data = temp_data[['Lon', 'Lat']].astype('float64').round(6)
+            temp_data['temp_color'] = temp_colors(temp_values)
+            temp_data['temp_size'] = np.round((temp_values - temp_min) / (temp_max - temp_min) * 40 + 15, 1) if temp_max > temp_min else 25
+
+            # Use ColumnLayer for temperature (rectangular columns)
+            temp_columns = pdk.Layer(
+                'ColumnLayer',
+                data=temp_data,
+                get_position='[Lon, Lat]',
+                get_fill_color='temp_color',
+                get_elevation='temp_size',
+                elevation_scale=2,
+                radius=15,
+                pickable=False,
+                auto_highlight=False,
+                opacity=0.7
+            )
+
+            layers.append(temp_columns)
+
+    # Check if any layers exist
+   
+
+    # Set the viewport location
+    view_state = pdk.ViewState(
+        latitude=df['Lat'].mean(),
+        longitude=df['Lon'].mean(),
+        zoom=14,
+        bearing=0,
+        pitch=45
+    )
+
+    # Render with LineLayer
+    r = pdk.Deck(
+        layers=layers, 
+        map_style='road',
+        initial_view_state=view_state,
+        tooltip={
+            "html": "<b>CO₂:</b> {co2_value} ppm<br/><b>PM2.5:</b> {pm25_value} μg/m³<br/><b>Calidad:</b> {pm25_category}<br/><b>Temp:</b> {temperature} °C<br/><b>Tiempo:</b> {timestamp}<br/><b>Ubicación:</b> {location}",
+            "style": {
+                "backgroundColor": "rgba(0, 0, 0, 0.8)",
+                "color": "white",
+                "borderRadius": "5px",
+                "padding": "10px",
+                "fontSize": "12px"
+            }
+        }
+    )
+    
+    return r
+
 # Cachea el cliente de conexión.
 @st.cache_resource(show_time=True,show_spinner=False)
-def get_cached_client() -> InfluxDBClient:
+def _connect_client() -> InfluxDBClient:
     with st.spinner("Estableciendo conexión con SmartCampus UIS..."):
         client = get_client_or_raise()
     return client
 
-# Cachea datos (dependen de parámetros).
-@st.cache_data(ttl=10, show_spinner=False)
+# Camino rápido a nivel de módulo: tras la primera conexión, obtener el
+# cliente es leer una variable, sin lookup de cache_resource ni spinner
+_client = None
+
+def get_cached_client() -> InfluxDBClient:
+    global _client
+    if _client is None:
+        _client = _connect_client()
+    return _client
+
+# Cachea datos (dependen de parámetros). cache_resource en lugar de
+# cache_data: devuelve el mismo objeto sin picklear/despicklear el frame
+# completo en cada hit; los consumidores lo tratan como de solo lectura
+# (prepare_map_df copia antes de mutar).
+@st.cache_resource(ttl=10, max_entries=16, show_spinner=False)
 def cached_query(flux: str):
     client = get_cached_client()
     return run_query(client, flux)
 
+# Refrescador de fondo: la UI lee snapshots sin bloquear en la query.
+# Clave estable (bucket, every): el string Flux embebe rounded_start(100),
+# que cambia cada hora y crearía un refrescador nuevo por hora dejando el
+# anterior (y su hilo) vivos; el callable recomputa el inicio en cada ciclo.
+@st.cache_resource(show_spinner=False)
+def get_data_refresher(bucket: str, every: str) -> DataRefresher:
+    return DataRefresher(
+        lambda: flux_query(bucket, start=rounded_start(100), every=every),
+        interval_seconds=10.0,
+    )
+
 @st.fragment()
 def plot_map(df, selected_parameters, selected_aqi_categories=None, auto_refresh=False):
-    import numpy as np
-    # Definir constantes para las columnas de datos ------------------
-
-    PM25_COLUMN = 'PM2.5'
-    CO2_COLUMN = 'CO2'
-    TEMP_COLUMN = 'Temperature'
-
-    PM25_THRESHOLDS = [
-                    (0.0, 12.0, 0, 50, "Buena", "#00e400"),
-                    (12.1, 35.4, 51, 100, "Moderada", "#ffff00"),
-                    (35.5, 55.4, 101, 150, "Dañina para sensibles", "#ff7e00"),
-                    (55.5, 150.4, 151, 200, "Dañina", "#ff0000"),
-                    (150.5, 250.4, 201, 300, "Muy dañina", "#8f3f97"),
-                    (250.5, 500.4, 301, 500, "Peligrosa", "#7e0023")
-                ]
-    
-    # Functions ------------------------------------------------
-    def get_pm25_color_and_category(pm25_value):
-                for low, high, aqi_low, aqi_high, category, color_hex in PM25_THRESHOLDS:
-                    if low <= pm25_value <= high:
-                        # Convertir hex a RGB con transparencia
-                        r = int(color_hex[1:3], 16)
-                        g = int(color_hex[3:5], 16)
-                        b = int(color_hex[5:7], 16)
-                        return [r, g, b, 180], category
-                # Si está fuera de rango, usar el último threshold
-                r = int(PM25_THRESHOLDS[-1][5][1:3], 16)
-                g = int(PM25_THRESHOLDS[-1][5][3:5], 16)
-                b = int(PM25_THRESHOLDS[-1][5][5:7], 16)
-                return [r, g, b, 180], PM25_THRESHOLDS[-1][4]
-
-    def build_paths(df: pd.DataFrame, selected_aqi_categories=None) -> list[dict]:
-        
-        paths_data = []
-        if len(df) < 2:
-            return paths_data
-
-        def _build_for_subset(sub: pd.DataFrame) -> list[dict]:
-            # Ensure data is sorted by time within each subset
-            if "_time" in sub.columns:
-                sub = sub.sort_values("_time").copy()
-            else:
-                sub = sub.copy()
-            
-            # Filter out invalid coordinates (-1, -1) within the subset
-            if 'Lat' in sub.columns and 'Lon' in sub.columns:
-                sub = sub[(sub['Lat'] != -1) & (sub['Lon'] != -1)].copy()
-            
-            # If after filtering we have less than 2 points, return empty
-            if len(sub) < 2:
-                return []
-            
-            local_paths = []
-            # Create simple paths between consecutive valid points
-            for i in range(len(sub) - 1):
-                current_point = sub.iloc[i]
-                next_point = sub.iloc[i + 1]
-
-                # Check time gap - don't create path if more than 3 minutes apart
-                if '_time' in sub.columns:
-                    current_time = current_point['_time']
-                    next_time = next_point['_time']
-                    
-                    if pd.notna(current_time) and pd.notna(next_time):
-                        try:
-                            time_diff = abs((next_time - current_time).total_seconds())
-                            if time_diff > 180:  # 3 minutes = 180 seconds
-                                continue  # Skip this path segment due to time gap
-                        except Exception:
-                            # If time comparison fails, skip this segment to be safe
-                            continue
-
-                # Check distance gap - don't create path if points are too far apart
-                # Calculate approximate distance in degrees (rough estimate)
-                lat_diff = abs(next_point['Lat'] - current_point['Lat'])
-                lon_diff = abs(next_point['Lon'] - current_point['Lon'])
-                distance_degrees = (lat_diff**2 + lon_diff**2)**0.5
-                
-                # Skip if distance is more than ~0.01 degrees (roughly 1km)
-                if distance_degrees > 0.01:
-                    continue  # Skip this path segment due to large distance gap
-
-                # Get current point's PM2.5 category
-                current_category = current_point.get("pm25_category", "No disponible")
-                
-                # Determine opacity based on AQI filter selection
-                if selected_aqi_categories is None or current_category in selected_aqi_categories:
-                    opacity = 200  # Full opacity for selected categories
-                else:
-                    opacity = 60   # Reduced opacity for non-selected categories
-
-                # Color
-                if "pm25_color" in sub.columns:
-                    color = current_point["pm25_color"]
-                    if isinstance(color, list) and len(color) >= 3:
-                        path_color = [color[0], color[1], color[2], opacity]
-                    else:
-                        path_color = [0, 228, 0, opacity]
-                else:
-                    path_color = [0, 228, 0, opacity]
-
-                path = {
-                    "start_lon": current_point["Lon"],
-                    "start_lat": current_point["Lat"],
-                    "start_elevation": 10,  
-                    "end_lon": next_point["Lon"],
-                    "end_lat": next_point["Lat"],
-                    "end_elevation": 10,    
-                    "R": path_color[0],
-                    "G": path_color[1],
-                    "B": path_color[2],
-                    "A": opacity,  # Store opacity separately for easier access
-                    "pm25_category": current_category,
-                    "co2_value": current_point.get("co2_value", 0),
-                    "pm25_value": current_point.get("pm25_value", 0),
-                    "temperature": current_point.get("temperature", 0),
-                    "timestamp": (
-                        format_colombia_time(current_point["_time"])
-                        if "_time" in current_point and pd.notna(current_point["_time"])
-                        else "No disponible"
-                    ),
-                    "location": current_point.get("location", "No disponible"),
-                }
-                local_paths.append(path)
-            return local_paths
-
-        if "location" in df.columns:
-            # Group by location to ensure we don't connect paths between different routes
-            for location, sub in df.groupby("location"):
-                if len(sub) >= 2:  # Only process if we have at least 2 points
-                    paths_data.extend(_build_for_subset(sub))
-        else:
-            if "header_deviceId" in df.columns:
-                for device, sub in df.groupby("header_deviceId"):
-                    if len(sub) >= 2:
-                        paths_data.extend(_build_for_subset(sub))
-            else:
-                paths_data = _build_for_subset(df)
-
-        return paths_data
-    
-    
 
     #------------------- Mapa principal ------------------
                 
@@ -191,14 +503,9 @@ def plot_map(df, selected_parameters, selected_aqi_categories=None, auto_refresh
             st.pydeck_chart(r, height=450)
             return
 
-        # Filter out invalid coordinates (-1, -1) before processing
-        if 'Lat' in df.columns and 'Lon' in df.columns:
-            initial_count = len(df)
-            # Remove rows where Lat or Lon is -1
-            df = df[(df['Lat'] != -1) & (df['Lon'] != -1)].copy()
-            
-            
-        
+        # Filtrado + enriquecimiento cacheados por fingerprint del frame
+        df = prepare_map_df(df)
+
         # Check if we still have data after filtering
         if df.empty:
             st.warning("No hay datos válidos para mostrar en el mapa después del filtrado de coordenadas.")
@@ -216,259 +523,15 @@ def plot_map(df, selected_parameters, selected_aqi_categories=None, auto_refresh
             st.pydeck_chart(r, height=450)
             return
 
-        # Crear columna layer como la media de los valores de contaminación
-        pollution_columns = [CO2_COLUMN, PM25_COLUMN]
-        
-        # Verificar que las columnas existen y calcular la media
-        available_columns = [col for col in pollution_columns if col in df.columns]
-        
-        if available_columns:
-            # Calcular la media de las columnas de contaminación disponibles
-            df = df.copy()
-            df['layer'] = df[available_columns].mean(axis=1, skipna=True)            
-                
-            # Aplicar colores y categorías
-            df[['pm25_color', 'pm25_category']] = df[PM25_COLUMN].apply(
-                lambda x: pd.Series(get_pm25_color_and_category(x))
-            )
-            
-            # Crear columnas para el tooltip
-            df['co2_value'] = df.get(CO2_COLUMN, 0).round(1)
-            df['pm25_value'] = df[PM25_COLUMN].round(1)
-            df['temperature'] = df.get(TEMP_COLUMN, 0).round(1)
-            
-        # Initialize layers list
-        layers = []
-        
-        # Add heatmap layers based on selected parameters
-        if selected_parameters and isinstance(selected_parameters, dict):
-            
-            # CO2 Scatter Layer
-            if selected_parameters.get('CO2', False) and 'CO2' in df.columns:
-                co2_data = df.dropna(subset=['CO2']).copy()
-                # Additional filtering for invalid coordinates
-                if 'Lat' in co2_data.columns and 'Lon' in co2_data.columns:
-                    co2_data = co2_data[(co2_data['Lat'] != -1) & (co2_data['Lon'] != -1)].copy()
-                
-                if not co2_data.empty:
-                    # Get min and max CO2 values for color scaling
-                    co2_min = co2_data['CO2'].min()
-                    co2_max = co2_data['CO2'].max()
-                    
-                    # Create color based on CO2 value using standard thresholds
-                    def get_co2_color(co2_value):
-                        # Standard CO2 thresholds (ppm)
-                        if co2_value <= 400:
-                            return [0, 255, 0, 180]    # Green - Outdoor level
-                        elif co2_value <= 600:
-                            return [128, 255, 0, 180]  # Light green - Acceptable
-                        elif co2_value <= 1000:
-                            return [255, 255, 0, 180]  # Yellow - Drowsiness may begin
-                        elif co2_value <= 5000:
-                            return [255, 165, 0, 180]  # Orange - Workplace exposure limit
-                        elif co2_value <= 10000:
-                            return [255, 69, 0, 180]   # Red orange - Drowsiness
-                        else:
-                            return [255, 0, 0, 180]    # Red - Immediately dangerous
-                    
-                    # Apply colors to data
-                    co2_data['co2_color'] = co2_data['CO2'].apply(get_co2_color)
-                    co2_data['co2_value'] = co2_data['CO2'].round(1)
-                    co2_data['timestamp'] = co2_data['_time'].apply(format_colombia_time) if '_time' in co2_data.columns else 'No disponible'
-                    
-                    co2_scatter = pdk.Layer(
-                        'ScatterplotLayer',
-                        data=co2_data,
-                        get_position='[Lon, Lat]',
-                        get_color='co2_color',
-                        opacity=0.5,
-                        pickable=False
-                    )
-                    layers.append(co2_scatter)
-            
-            # Temperature Heatmap Layer
-            if selected_parameters.get('Temp', False) and 'Temperature' in df.columns:
-                temp_data = df.dropna(subset=['Temperature']).copy()
-                # Additional filtering for invalid coordinates
-                if 'Lat' in temp_data.columns and 'Lon' in temp_data.columns:
-                    temp_data = temp_data[(temp_data['Lat'] != -1) & (temp_data['Lon'] != -1)].copy()
-                
-                if not temp_data.empty:
-                    # Normalize temperature values for better visualization (0-1 range)
-                    temp_min = temp_data['Temperature'].min()
-                    temp_max = temp_data['Temperature'].max()
-                    if temp_max > temp_min:
-                        temp_data['weight'] = (temp_data['Temperature'] - temp_min) / (temp_max - temp_min)
-                    else:
-                        temp_data['weight'] = 0.5
-                    
-                    temp_heatmap = pdk.Layer(
-                        'HeatmapLayer',
-                        data=temp_data,
-                        get_position='[Lon, Lat]',
-                        get_weight='weight',
-                        radius_pixels=60,
-                        opacity=0.6,
-                        color_range=[
-                            [0, 0, 255],      # Blue (cold)
-                            [0, 255, 255],    # Cyan 
-                            [0, 255, 0],      # Green
-                            [255, 255, 0],    # Yellow
-                            [255, 165, 0],    # Orange
-                            [255, 0, 0]       # Red (hot)
-                        ],
-                        pickable=False
-                    )
-                    layers.append(temp_heatmap)
-        
-        # Add PM2.5 paths layer only if PM2.5 is selected
-        if PM25_COLUMN in selected_parameters:
-            # Convert to DataFrame and add LineLayer for PM2.5 paths
-            
-            paths_df = build_paths(df, selected_aqi_categories)
-            # Define a LineLayer to display paths on the map
-            line_layer = pdk.Layer(
-                'LineLayer',
-                data=paths_df,
-                get_source_position='[start_lon, start_lat, start_elevation]',
-                get_target_position='[end_lon, end_lat, end_elevation]',
-                get_color='[R, G, B, A]',  # Use the opacity from data
-                get_width=10,
-                highlight_color=[0, 0, 255],
-                picking_radius=10,
-                auto_highlight=True,
-                pickable=True,
-                wireframe=False,
-                extruded=True
-            )
-            
-            layers.append(line_layer)
-        
-        if CO2_COLUMN in selected_parameters:
-            co2_data = df.dropna(subset=['CO2']).copy()
-            if not co2_data.empty:
-                # Get min and max CO2 values for color scaling
-                co2_min = co2_data['CO2'].min()
-                co2_max = co2_data['CO2'].max()
-                
-                # Create color based on CO2 value using standard thresholds
-                def get_co2_color(co2_value):
-                    # Standard CO2 thresholds (ppm)
-                    if co2_value <= 400:
-                        return [0, 255, 0, 180]    # Green - Outdoor level
-                    elif co2_value <= 600:
-                        return [128, 255, 0, 180]  # Light green - Acceptable
-                    elif co2_value <= 1000:
-                        return [255, 255, 0, 180]  # Yellow - Drowsiness may begin
-                    elif co2_value <= 5000:
-                        return [255, 165, 0, 180]  # Orange - Workplace exposure limit
-                    elif co2_value <= 10000:
-                        return [255, 69, 0, 180]   # Red orange - Drowsiness
-                    else:
-                        return [255, 0, 0, 180]    # Red - Immediately dangerous
-                
-                # Apply colors to data
-                co2_data['co2_color'] = co2_data['CO2'].apply(get_co2_color)
-                co2_data['co2_size'] = ((co2_data['CO2'] - co2_min) / (co2_max - co2_min) * 50 + 10) if co2_max > co2_min else 30
-                co2_data['co2_value'] = co2_data['CO2'].round(1)
-                co2_data['timestamp'] = co2_data['_time'].apply(format_colombia_time) if '_time' in co2_data.columns else 'No disponible'
-
-                co2_scatter = pdk.Layer(
-                    'ScatterplotLayer',
-                    data=co2_data,
-                    get_position='[Lon, Lat]',
-                    get_color='co2_color',
-                    get_radius='co2_size',
-                    radius_scale=1,
-                    radius_min_pixels=5,
-                    radius_max_pixels=60,
-                    pickable=False,
-                    auto_highlight=False,
-                    opacity=0.8
-                )
-
-                layers.append(co2_scatter)
-
-        if TEMP_COLUMN in selected_parameters:
-            temp_data = df.dropna(subset=['Temperature']).copy()
-            # Additional filtering for invalid coordinates
-            if 'Lat' in temp_data.columns and 'Lon' in temp_data.columns:
-                temp_data = temp_data[(temp_data['Lat'] != -1) & (temp_data['Lon'] != -1)].copy()
-            
-            if not temp_data.empty:
-                # Get min and max temperature values for color scaling
-                temp_min = temp_data['Temperature'].min()
-                temp_max = temp_data['Temperature'].max()
-                
-                # Create color based on temperature value using standard thresholds
-                def get_temp_color(temp_value):
-                    # Standard temperature thresholds (°C)
-                    if temp_value <= 10:
-                        return [0, 0, 255, 180]     # Blue - Very cold
-                    elif temp_value <= 15:
-                        return [0, 128, 255, 180]   # Light blue - Cold
-                    elif temp_value <= 20:
-                        return [0, 255, 255, 180]   # Cyan - Cool
-                    elif temp_value <= 25:
-                        return [0, 255, 0, 180]     # Green - Comfortable
-                    elif temp_value <= 30:
-                        return [255, 255, 0, 180]   # Yellow - Warm
-                    elif temp_value <= 35:
-                        return [255, 165, 0, 180]   # Orange - Hot
-                    else:
-                        return [255, 0, 0, 180]     # Red - Very hot
-                
-                # Apply colors and size to data
-                temp_data['temp_color'] = temp_data['Temperature'].apply(get_temp_color)
-                temp_data['temp_size'] = ((temp_data['Temperature'] - temp_min) / (temp_max - temp_min) * 40 + 15) if temp_max > temp_min else 25
-                temp_data['temp_value'] = temp_data['Temperature'].round(1)
-                temp_data['timestamp'] = temp_data['_time'].apply(format_colombia_time) if '_time' in temp_data.columns else 'No disponible'
-
-                # Use ColumnLayer for temperature (rectangular columns)
-                temp_columns = pdk.Layer(
-                    'ColumnLayer',
-                    data=temp_data,
-                    get_position='[Lon, Lat]',
-                    get_fill_color='temp_color',
-                    get_elevation='temp_size',
-                    elevation_scale=2,
-                    radius=15,
-                    pickable=False,
-                    auto_highlight=False,
-                    opacity=0.7
-                )
-
-                layers.append(temp_columns)
-
-        # Check if any layers exist
-       
-
-        # Set the viewport location
-        view_state = pdk.ViewState(
-            latitude=df['Lat'].mean(),
-            longitude=df['Lon'].mean(),
-            zoom=14,
-            bearing=0,
-            pitch=45
-        )
+        # Normalizar la seleccion a una clave hashable para la cache del deck
+        dict_mode = isinstance(selected_parameters, dict)
+        if dict_mode:
+            params_key = tuple(k for k, v in selected_parameters.items() if v)
+        else:
+            params_key = tuple(selected_parameters) if selected_parameters else ()
+        aqi_key = tuple(selected_aqi_categories) if selected_aqi_categories is not None else None
+        r = build_map_deck(df, params_key, dict_mode, aqi_key)
 
-        # Render with LineLayer
-        r = pdk.Deck(
-            layers=layers, 
-            map_style='road',
-            initial_view_state=view_state,
-            tooltip={
-                "html": "<b>CO₂:</b> {co2_value} ppm<br/><b>PM2.5:</b> {pm25_value} μg/m³<br/><b>Calidad:</b> {pm25_category}<br/><b>Temp:</b> {temperature} °C<br/><b>Tiempo:</b> {timestamp}<br/><b>Ubicación:</b> {location}",
-                "style": {
-                    "backgroundColor": "rgba(0, 0, 0, 0.8)",
-                    "color": "white",
-                    "borderRadius": "5px",
-                    "padding": "10px",
-                    "fontSize": "12px"
-                }
-            }
-        )
-        
         # Mostrar en Streamlit
         st.pydeck_chart(r, height=450)
 
@@ -669,43 +732,42 @@ def plot_map(df, selected_parameters, selected_aqi_categories=None, auto_refresh
 @st.fragment(run_every=10)
 def auto_refresh_map(date_range, selected_routes, selected_parameters, selected_aqi_categories=None, selected_hours=None):
     """Fragment that runs every 5 seconds when auto-refresh is enabled"""
-    import pandas as pd
-    
-    # Re-query fresh data
-    fields = ["Lat", "Lon", "CO2", "PM2_5", "Temperature", "location"]
-    flux = flux_query("messages", start="-100d")
-    
+
     try:
-        client = get_cached_client()
-        # Clear cache to get fresh data
-        st.cache_data.clear()
-        fresh_df = cached_query(flux)
+        # Snapshot del hilo de fondo: cero espera en el rerun del fragmento.
+        # Ventana de 1m para 100 días: aggregateWindow se resuelve en el
+        # motor de almacenamiento y viaja ~1/6 de los puntos que con 10s
+        fresh_df, _ = get_data_refresher("messages", "1m").snapshot()
+        if fresh_df.empty:
+            # Primer tick: el hilo de fondo aún no trae los 100 días. Pintar
+            # ya con una ventana corta en lugar de bloquear en la query larga;
+            # el siguiente tick (run_every=10) recoge el snapshot completo.
+            fresh_df = cached_query(flux_query("messages", start=rounded_start(1)))
 
-        print(fresh_df.columns)
-        
         if not fresh_df.empty:
             # Convert routes to integers for better handling
             
             
-            # Apply the same filters as main app
-            filtered_df = fresh_df.copy()
-            
+            # Apply the same filters as main app: una sola máscara booleana,
+            # un solo frame filtrado, sin copias intermedias
+            mask = pd.Series(True, index=fresh_df.index)
+
             # Apply date filter
             if '_time' in fresh_df.columns and len(date_range) == 2:
                 start_date, end_date = date_range
-                filtered_df = filtered_df[
-                    (filtered_df['_time'].dt.date >= start_date) & 
-                    (filtered_df['_time'].dt.date <= end_date)
-                ]
-            
+                # datetime64[D] respaldado por int64, sin objetos date por fila
+                dates = fresh_df['_time'].dt.tz_localize(None).to_numpy().astype('datetime64[D]')
+                mask &= (dates >= np.datetime64(start_date)) & (dates <= np.datetime64(end_date))
+
             # Apply hour filter
             if '_time' in fresh_df.columns and selected_hours:
-                filtered_df['hour'] = filtered_df['_time'].dt.hour
-                filtered_df = filtered_df[filtered_df['hour'].isin(selected_hours)]
-            
+                mask &= fresh_df['_time'].dt.hour.isin(selected_hours)
+
             # Apply route filter
             if 'location' in fresh_df.columns and selected_routes:
-                filtered_df = filtered_df[filtered_df['location'].isin(selected_routes)]
+                mask &= fresh_df['location'].isin(selected_routes)
+
+            filtered_df = fresh_df.loc[mask]
 
             if not filtered_df.empty:  
                 # Plot the refreshed map
@@ -742,7 +804,9 @@ def main():
         st.stop()
 
     # Query to fetch data
-    flux = flux_query(bucket="messages", start="-100d")
+    # Ventana de 1m para 100 días: aggregateWindow se resuelve en el motor
+    # de almacenamiento y viaja ~1/6 de los puntos que con 10s
+    flux = flux_query(bucket="messages", start=rounded_start(100), every="1m")
 
     with st.spinner("Consultando datos..."):
         try:
@@ -789,10 +853,11 @@ def main():
             
             # Hour filter
             if '_time' in df.columns:
-                # Extract unique hours from the data
-                df['hour'] = df['_time'].dt.hour
-                min_hour = int(df['hour'].min())
-                max_hour = int(df['hour'].max())
+                # Extract unique hours from the data (serie local: el frame
+                # cacheado es compartido y no debe mutarse)
+                hours = df['_time'].dt.hour
+                min_hour = int(hours.min())
+                max_hour = int(hours.max())
                 
                 # Handle case when there's only one hour of data
                 if min_hour == max_hour:
@@ -814,11 +879,14 @@ def main():
         
             # Route filter
             if 'location' in df.columns:
-                unique_routes = df['location'].dropna().unique().tolist()
+                # La columna llega como category desde la ingesta: sus
+                # categorías ya son los valores únicos ordenados, sin
+                # dropna/unique/sorted sobre la serie completa
+                unique_routes = df['location'].cat.categories.tolist()
                 selected_routes = st.multiselect(
                     "Rutas a mostrar:",
-                    options=sorted(unique_routes),
-                    default=sorted(unique_routes),
+                    options=unique_routes,
+                    default=unique_routes,
                     key="route_filter"
                 )
             else:
@@ -848,20 +916,32 @@ def main():
         # Apply filters and show filtered map
         with st.container():
             
-            # Apply filters to dataframe
-            filtered_df = df.copy()
-            
-            # Apply date filter
-            if '_time' in df.columns and len(date_range) == 2:
-                start_date, end_date = date_range
-                filtered_df = filtered_df[
-                    (filtered_df['_time'].dt.date >= start_date) & 
-                    (filtered_df['_time'].dt.date <= end_date)
-                ]
-            
-            filtered_df['hour'] = filtered_df['_time'].dt.hour
-            filtered_df = filtered_df[filtered_df['hour'].isin(selected_hours)]
-            filtered_df = filtered_df[filtered_df['location'].isin(selected_routes)]
+            # Fingerprint de los filtros + snapshot: los reruns que no cambian
+            # nada (clicks fuera de un widget, abrir la leyenda) reutilizan el
+            # frame ya filtrado en lugar de recalcular las máscaras
+            filter_key = (
+                tuple(date_range),
+                tuple(selected_hours),
+                tuple(selected_routes),
+                _paths_df_key(df),
+            )
+            if st.session_state.get('_map_filter_key') == filter_key:
+                filtered_df = st.session_state['_map_filtered_df']
+            else:
+                # Apply filters to dataframe: máscara booleana acumulada en
+                # lugar de copiar y re-filtrar el frame completo tres veces
+                mask = df['_time'].dt.hour.isin(selected_hours) & df['location'].isin(selected_routes)
+
+                # Apply date filter
+                if '_time' in df.columns and len(date_range) == 2:
+                    start_date, end_date = date_range
+                    # datetime64[D] respaldado por int64, sin objetos date por fila
+                    dates = df['_time'].dt.tz_localize(None).to_numpy().astype('datetime64[D]')
+                    mask &= (dates >= np.datetime64(start_date)) & (dates <= np.datetime64(end_date))
+
+                filtered_df = df.loc[mask]
+                st.session_state['_map_filter_key'] = filter_key
+                st.session_state['_map_filtered_df'] = filtered_df
             
             # Show filtered results
             if not filtered_df.empty:
@@ -883,38 +963,20 @@ def main():
                 with st.container(key="graph1"):
                     st.html("""<div class="graphtitle"> Concentración de PM2.5 y CO2 por ruta </div>""")
 
-                    df["_time"] = pd.to_datetime(df["_time"].dt.tz_localize(None))
-                    dfchart1 = df[df["_time"] > (datetime.now() - pd.Timedelta(days=7))]
-                    dfchart1x = dfchart1.groupby('location')['PM2.5'].mean().sort_values(ascending=True)
-                    dfchart1y = dfchart1.groupby('location')['CO2'].mean().sort_values(ascending=True)
-
-                    # Create color list based on contamination classification using the same thresholds
-                    def get_route_colors(pm25_values):
-                        # Define PM2.5 thresholds (same as in plot_map function)
-                        thresholds = [
-                            (0.0, 12.0, 0, 50, "Buena", "#00e400"),
-                            (12.1, 35.4, 51, 100, "Moderada", "#ffff00"),
-                            (35.5, 55.4, 101, 150, "Dañina para sensibles", "#ff7e00"),
-                            (55.5, 150.4, 151, 200, "Dañina", "#ff0000"),
-                            (150.5, 250.4, 201, 300, "Muy dañina", "#8f3f97"),
-                            (250.5, 500.4, 301, 500, "Peligrosa", "#7e0023")
-                        ]
-                        
-                        colors = []
-                        for pm25_value in pm25_values:
-                            for low, high, aqi_low, aqi_high, category, color_hex in thresholds:
-                                if low <= pm25_value <= high:
-                                    colors.append(color_hex)
-                                    break
-                            else:
-                                # If outside range, use the last threshold color
-                                colors.append(thresholds[-1][5])
-                        return colors
-                    
-                    route_colors = get_route_colors(dfchart1x.values)
+                    # Hora local naive en una copia ligera (assign): no mutar
+                    # el frame compartido por cached_query, igual que `hours`
+                    # en los filtros de arriba
+                    df7 = df.assign(_time=df["_time"].dt.tz_localize(None))
+                    dfchart1 = df7[df7["_time"] > (datetime.now() - pd.Timedelta(days=7))]
+                    # Una sola pasada por ambas columnas; además mantiene el CO2
+                    # alineado con su ruta (antes se ordenaba por separado)
+                    route_means = dfchart1.groupby('location', observed=True)[['PM2.5', 'CO2']].mean().sort_values('PM2.5')
+
+                    # Colores según la clasificación de contaminación (vectorizado a nivel de módulo)
+                    route_colors = get_route_colors(route_means['PM2.5'].values)
 
-                    fig = px.bar({'Ruta': dfchart1x.index,
-                    'Promedio PM2.5': dfchart1x.values, 'Promedio CO2': dfchart1y.values,},
+                    fig = px.bar({'Ruta': route_means.index,
+                    'Promedio PM2.5': route_means['PM2.5'].values, 'Promedio CO2': route_means['CO2'].values,},
                     x="Ruta",y=["Promedio CO2", "Promedio PM2.5"], barmode = 'group', labels={'value':'Concentración'},
                     color_discrete_sequence=["#0FA539","#00707c"])
 
@@ -932,13 +994,14 @@ def main():
                     <div class="graphtitle"> Evolución por día del PM2.5 y CO2 </div>
                     """)
 
-                    dfchart2 = df[df["_time"] > (datetime.now() - pd.Timedelta(days=7))]
-                    
-                    dfchart2x = dfchart2.groupby('_time')['PM2.5'].mean()
-                    dfchart2y = dfchart2.groupby('_time')['CO2'].mean()
+                    # Misma ventana local de 7 días ya filtrada para graph1
+                    dfchart2 = dfchart1
+
+                    # Ambos promedios en una sola pasada sobre el frame filtrado
+                    time_means = dfchart2.groupby('_time')[['PM2.5', 'CO2']].mean()
 
-                    fig2 = px.line({'Fecha': dfchart2x.index,
-                    'Promedio PM2.5': dfchart2x.values, 'Promedio CO2': dfchart2y.values,},
+                    fig2 = px.line({'Fecha': time_means.index,
+                    'Promedio PM2.5': time_means['PM2.5'].values, 'Promedio CO2': time_means['CO2'].values,},
                     x="Fecha",y=["Promedio CO2", "Promedio PM2.5"], labels={'value':'Concentración'},
                     color_discrete_sequence=["#0FA539","#00707c"])
 
@@ -1,20 +1,32 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from data.connection import get_client_or_raise, run_query, flux_query, ConnectionNotReady
+from datetime import datetime, timedelta
+from data.connection import get_client_or_raise, run_query, flux_query, rounded_start, ConnectionNotReady
 from influxdb_client import InfluxDBClient
-from utils.timezone_utils import format_colombia_time
+from utils.timezone_utils import format_colombia_time, COLOMBIA_UTC_OFFSET_HOURS
 
 # Cachea el cliente
 @st.cache_resource(show_time=True, show_spinner=False)
-def get_cached_client() -> InfluxDBClient:
+def _connect_client() -> InfluxDBClient:
     with st.spinner("Estableciendo conexión con SmartCampus UIS..."):
         client = get_client_or_raise()
     return client
 
-# Cachea datos (dependen de parámetros; pon TTLs cortos)
-@st.cache_data(ttl=10, show_spinner=False)
+# Camino rápido a nivel de módulo: tras la primera conexión, obtener el
+# cliente es leer una variable, sin lookup de cache_resource ni spinner
+_client = None
+
+def get_cached_client() -> InfluxDBClient:
+    global _client
+    if _client is None:
+        _client = _connect_client()
+    return _client
+
+# Cachea datos (dependen de parámetros; pon TTLs cortos). cache_resource
+# comparte el mismo objeto entre reruns sin picklearlo en cada hit; los
+# consumidores copian antes de mutar (display_df) o solo leen.
+@st.cache_resource(ttl=10, max_entries=16, show_spinner=False)
 def cached_query(flux: str):
     client = get_cached_client()
     return run_query(client, flux)
@@ -144,7 +156,7 @@ def main():
         st.stop()
 
     # Query
-    flux = flux_query("messages", start="-100d")
+    flux = flux_query("messages", start=rounded_start(100))
 
     with st.spinner("Consultando datos..."):
         try:
@@ -164,7 +176,9 @@ def main():
             
             # Route filter
             if 'location' in df.columns:
-                available_routes = sorted(df['location'].dropna().unique())
+                # Categorías de la ingesta: valores únicos ya ordenados,
+                # sin dropna/unique/sorted sobre la serie completa
+                available_routes = df['location'].cat.categories.tolist()
                 selected_routes = st.sidebar.multiselect(
                     "Rutas seleccionadas:",
                     options=available_routes,
@@ -177,8 +191,11 @@ def main():
             # Date filter
             if '_time' in df.columns:
                 # Get available dates
-                df['Fecha'] = df['_time'].dt.date
-                available_dates = sorted(df['Fecha'].unique())
+                # Días únicos en una sola pasada C sobre datetime64[D]; solo
+                # las ~pocas etiquetas resultantes se convierten a date para
+                # el widget (el frame cacheado es compartido y no se muta)
+                day_values = np.unique(df['_time'].dt.tz_localize(None).to_numpy().astype('datetime64[D]'))
+                available_dates = day_values.astype('O').tolist()
                 
                 if available_dates:
                     min_date = min(available_dates)
@@ -204,20 +221,39 @@ def main():
     with st.container(key="table"):  
 
         if 'df' in locals() and not df.empty:
-            # Apply filters
-            filtered_df = df.copy()
-            
-            # Apply route filter
-            if selected_routes and 'location' in filtered_df.columns:
-                filtered_df = filtered_df[filtered_df['location'].isin(selected_routes)]
-            
-            # Apply date filter
-            if start_date and end_date and '_time' in filtered_df.columns:
-                filtered_df = filtered_df[
-                    (filtered_df['_time'].dt.date >= start_date) & 
-                    (filtered_df['_time'].dt.date <= end_date)
-                ]
-            
+            # Empujar los filtros a Flux: si el usuario acota rutas o fechas,
+            # se consulta solo ese subconjunto en lugar de refiltrar en pandas
+            # los 100 días ya descargados
+            narrowed_routes = (
+                selected_routes
+                if selected_routes and len(selected_routes) < len(available_routes)
+                else None
+            )
+            narrowed_dates = (
+                start_date and end_date
+                and (start_date > min(available_dates) or end_date < max(available_dates))
+            )
+
+            if narrowed_routes or narrowed_dates:
+                # Las fechas del widget son locales (COT = UTC-5 fijo)
+                start_utc = datetime.combine(start_date, datetime.min.time()) + timedelta(hours=COLOMBIA_UTC_OFFSET_HOURS)
+                stop_utc = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1, hours=COLOMBIA_UTC_OFFSET_HOURS)
+                flux_filtered = flux_query(
+                    "messages",
+                    start=start_utc.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    stop=stop_utc.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    locations=narrowed_routes,
+                )
+                try:
+                    filtered_df = cached_query(flux_filtered)
+                except Exception as e:
+                    # Ante un fallo transitorio, mostrar el frame completo ya
+                    # cargado en lugar de romper el render con un traceback
+                    st.warning(f"No fue posible aplicar los filtros en el servidor. Detalle: {e}")
+                    filtered_df = df
+            else:
+                filtered_df = df
+
             # Show filter summary
             col1, col2, col3 = st.columns(3, gap=None)
             with col1:
@@ -1,6 +1,7 @@
 """
 Timezone utilities for Colombian timezone handling
 """
+import numpy as np
 import pandas as pd
 import pytz
 from datetime import datetime
@@ -8,14 +9,32 @@ from datetime import datetime
 # Define Colombian timezone
 COLOMBIA_TZ = pytz.timezone('America/Bogota')
 
+# America/Bogota es UTC-5 fijo (sin horario de verano)
+COLOMBIA_UTC_OFFSET_HOURS = 5
+
+def colombia_hour(series):
+    """Hora local colombiana (0-23) calculada con aritmética int64 sobre nanosegundos.
+
+    Evita el accessor .dt sobre la columna tz-aware: una sola operación
+    numpy en lugar de materializar objetos por fila.
+    """
+    ns = series.values.astype('datetime64[ns]').view('i8')
+    return (ns // 3_600_000_000_000 - COLOMBIA_UTC_OFFSET_HOURS) % 24
+
 def convert_to_colombia_time(df):
-    """Convert UTC timestamps to Colombian timezone"""
+    """Convert UTC timestamps to Colombian timezone (idempotente, sin trabajo por fila)"""
     if '_time' in df.columns:
-        # Ensure the datetime column is timezone-aware
+        # Garantizar dtype datetime64 real (una sola llamada en C, nunca object)
+        if not pd.api.types.is_datetime64_any_dtype(df['_time']):
+            df['_time'] = pd.to_datetime(df['_time'], utc=True, errors='coerce')
+
         if df['_time'].dt.tz is None:
             # If no timezone info, assume UTC
             df['_time'] = df['_time'].dt.tz_localize('UTC')
-        
+        elif str(df['_time'].dt.tz) == str(COLOMBIA_TZ):
+            # Ya está en hora colombiana; no repetir la conversión
+            return df
+
         # Convert to Colombian timezone
         df['_time'] = df['_time'].dt.tz_convert(COLOMBIA_TZ)
     return df
@@ -30,6 +49,19 @@ def format_colombia_time(timestamp):
     colombia_time = timestamp.astimezone(COLOMBIA_TZ)
     return colombia_time.strftime("%Y-%m-%d %H:%M:%S COT")
 
+def format_colombia_time_array(series):
+    """Versión vectorizada de format_colombia_time para una columna completa.
+
+    Formatea con np.datetime_as_string sobre el array datetime64 en lugar
+    de invocar strftime fila por fila.
+    """
+    s = series
+    if s.dt.tz is None:
+        s = s.dt.tz_localize('UTC')
+    naive = s.dt.tz_convert(COLOMBIA_TZ).dt.tz_localize(None)
+    stamps = np.datetime_as_string(naive.to_numpy(dtype='datetime64[s]'), unit='s')
+    return np.char.add(np.char.replace(stamps, 'T', ' '), ' COT')
+
 def get_current_colombia_time():
     """Get current time in Colombian timezone"""
     utc_now = datetime.utcnow()